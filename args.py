@@ -1,13 +1,7 @@
 import argparse
-from collections import namedtuple
 
-Arguments = namedtuple(
-    "ArgNamespace",
-    ["log_level"],
-)
 
-
-def get_arguments() -> Arguments:
+def get_arguments() -> argparse.Namespace:
     """Parse script arguments"""
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -16,5 +10,4 @@ def get_arguments() -> Arguments:
         type=str,
         help="The console log level. One of: [DEBUG, INFO, WARNING, ERROR]. ",
     )
-    args = parser.parse_args()
-    return args  # type: ignore
+    return parser.parse_args()
@@ -1,8 +1,13 @@
-import json
-import subprocess
+import functools
+import os
 from dataclasses import asdict, dataclass
 from typing import Any, Dict, List
 
+import yaml
+
+# Use the libyaml C bindings when available (much faster), falling back on the pure-Python loader
+_SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 @dataclass
 class Config:
@@ -53,9 +58,21 @@ class Config:
 
 
 def load_config(config_path="config.yaml") -> Config:
+    """
+    Load the config file, re-parsing it only when its modification time changes.
+    """
+    try:
+        mtime_ns = os.stat(config_path).st_mtime_ns
+    except OSError as e:
+        raise Config.InvalidConfig from e
+    return _load_config_cached(config_path, mtime_ns)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_config_cached(config_path: str, mtime_ns: int) -> Config:
     try:
-        result = subprocess.run(["yq", "-e", "-o=json", ".", config_path], capture_output=True)
-        data = json.loads(result.stdout)["config"]
+        with open(config_path, "rb") as f:
+            data = yaml.load(f, Loader=_SafeLoader)["config"]
         return Config(
             logdir=data["logs"]["dir"],
             max_email_payload_bytes=data["security"]["max_payload_bytes"],
@@ -74,5 +91,5 @@ def load_config(config_path="config.yaml") -> Config:
                 options=data["gunicorn"]["run_args"],
             ),
         )
-    except (KeyError, ValueError) as e:
+    except (OSError, KeyError, TypeError, ValueError, yaml.YAMLError) as e:
         raise Config.InvalidConfig from e
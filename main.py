@@ -1,14 +1,19 @@
+import functools
 import hashlib
 import hmac
+import io
+import logging
 import os
+import re
+import selectors
 import subprocess
 import time
-from datetime import datetime
-from uuid import uuid4
+from typing import Dict, List, cast
 
 import flask
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from werkzeug.exceptions import RequestEntityTooLarge
 
 from config import Config, load_config
 from logger import logger_from_config
@@ -17,6 +22,11 @@ from utils import request_to_sanitized_json
 app = flask.Flask(__name__)
 config = load_config()
 logger = logger_from_config(config)
+_API_SECRET_BYTES = config.api_secret.encode("utf-8")  # fixed for the lifetime of the process
+_SIGNATURE_RE = re.compile(r"[0-9a-f]{64}")  # a lowercase hex SHA-256 HMAC
+
+# Let Werkzeug reject oversized payloads with a 413 as soon as the body is read
+app.config["MAX_CONTENT_LENGTH"] = config.max_email_payload_bytes
 
 # Attach rate-limiter
 limiter = Limiter(
@@ -26,10 +36,6 @@ limiter = Limiter(
 )
 
 
-def now() -> datetime:
-    return datetime.now().astimezone()
-
-
 # Custom error handler for all HTTP exceptions.
 @app.errorhandler(Exception)
 def handle_exception(e):
@@ -41,21 +47,24 @@ def handle_exception(e):
     return flask.jsonify(error=str(e), code=code, success=False), code
 
 
-def _abort_if_payload_too_large() -> None:
+@app.errorhandler(RequestEntityTooLarge)
+def handle_payload_too_large(e: RequestEntityTooLarge):
     """
-    Abort request if the content is too large.
+    Log and reject requests whose payload exceeds `MAX_CONTENT_LENGTH`.
     """
-    max_bytes = config.max_email_payload_bytes
-    content_length = flask.request.content_length if flask.request.content_length else 0
-    if content_length > max_bytes:
+    # Don't build the sanitized request here, since parsing its form data would raise again
+    if logger.isEnabledFor(logging.WARNING):
         logger.warning(
-            "Rejected request with payload = {} KB > {} KB: {}.".format(
-                content_length / 1000,
-                max_bytes / 1000,
-                request_to_sanitized_json(flask.request),
+            "Rejected request to '{}' with payload > {} KB (Content-Length: {}) from ip: '{}', user_agent: '{}'.".format(
+                flask.request.path,
+                config.max_email_payload_bytes / 1000,
+                flask.request.content_length,
+                flask.request.headers.get("X-Forwarded-For", flask.request.remote_addr),
+                flask.request.user_agent.string,
             )
         )
-        flask.abort(413, description="Payload too large.")
+    e.description = "Payload too large."
+    return flask.jsonify(error=str(e), code=e.code, success=False), e.code
 
 
 def _abort_if_invalid_signature() -> None:
@@ -64,105 +73,178 @@ def _abort_if_invalid_signature() -> None:
     """
     signature = flask.request.headers.get("X-Signature")
     timestamp = flask.request.headers.get("X-Timestamp")
-    body = flask.request.get_data(as_text=True)
+    body = flask.request.get_data(cache=True)
 
     if not signature or not timestamp:
-        logger.warning(
-            "Rejected request because it was missing 'X-Signature': '{}', or 'X-Timestamp': '{}'. Request: {}".format(
-                signature,
-                timestamp,
-                request_to_sanitized_json(flask.request),
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(
+                "Rejected request because it was missing 'X-Signature': '{}', or 'X-Timestamp': '{}'. Request: {}".format(
+                    signature,
+                    timestamp,
+                    request_to_sanitized_json(flask.request),
+                )
             )
-        )
         flask.abort(403, "Missing auth header(s). Make sure you're sending 'X-Signature' and 'X-Timestamp'.")
 
+    try:
+        timestamp_age = abs(time.time() - int(timestamp))
+    except (ValueError, OverflowError):
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(
+                "Rejected request with timestamp '{}' because it's not a valid integer. Request: {}.".format(
+                    timestamp,
+                    request_to_sanitized_json(flask.request),
+                )
+            )
+        flask.abort(403, "Bad timestamp.")
+
     # Check timestamp is from the last 5 minutes
-    if abs(time.time() - int(timestamp)) > 300:
-        logger.warning(
-            "Rejected request with timestamp '{}' because it's too old. Request: {}.".format(
-                timestamp,
-                request_to_sanitized_json(flask.request),
+    if timestamp_age > 300:
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(
+                "Rejected request with timestamp '{}' because it's too old. Request: {}.".format(
+                    timestamp,
+                    request_to_sanitized_json(flask.request),
+                )
             )
-        )
         flask.abort(403, "Too old.")
 
-    # Compute the expected request signature and compare
-    message = timestamp + body
-    secret_bytes = config.api_secret.encode("utf-8")
-    expected_sig = hmac.new(secret_bytes, message.encode(), hashlib.sha256).hexdigest()
-    if not hmac.compare_digest(signature, expected_sig):
-        logger.warning(
-            "Rejected request with invalid signature. Request: {}.".format(
-                request_to_sanitized_json(flask.request),
+    # Compute the expected request signature over the timestamp followed by the raw body bytes and compare
+    h = hmac.new(_API_SECRET_BYTES, None, hashlib.sha256)
+    h.update(timestamp.encode("utf-8"))
+    h.update(body)  # feed the body separately rather than copying it into a concatenated message
+    expected_sig = h.digest()
+    # Only accept the exact lowercase hex that `hexdigest()` produces, since `bytes.fromhex` alone
+    # would also allow uppercase and whitespace between pairs.
+    if _SIGNATURE_RE.fullmatch(signature):
+        provided_sig = bytes.fromhex(signature)
+    else:
+        provided_sig = b""  # can never match
+    if not hmac.compare_digest(provided_sig, expected_sig):
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(
+                "Rejected request with invalid signature. Request: {}.".format(
+                    request_to_sanitized_json(flask.request),
+                )
             )
-        )
         flask.abort(403, "Invalid Signature.")
 
 
+def _log_subprocess_lines(app_name: str, lines: List[bytes], from_stderr: bool) -> None:
+    """
+    Log lines of subprocess output, batching consecutive lines at the same level into a single log call.
+    """
+    batch: List[str] = []
+    batch_level = logging.INFO
+    for line in lines:
+        text = line.decode("utf-8", errors="replace").strip()
+        # some processes use stderr for normal logging. Try to interpret what
+        # they are saying and also rely on exit_code for failure condition.
+        if from_stderr and ("error" in text.lower() or "failed" in text.lower()):
+            level = logging.ERROR
+        else:
+            level = logging.INFO
+        if batch and level != batch_level:
+            logger.log(batch_level, f"<{app_name}> " + f"\n<{app_name}> ".join(batch))
+            batch = []
+        batch.append(text)
+        batch_level = level
+    if batch:
+        logger.log(batch_level, f"<{app_name}> " + f"\n<{app_name}> ".join(batch))
+
+
+def _log_subprocess_output(proc: subprocess.Popen, app_name: str) -> None:
+    """
+    Log the subprocess's stdout and stderr as they are written. Whichever pipe has data is read
+    first, so a full pipe can't stall the subprocess while we are waiting on the other one.
+    """
+    buffer = bytearray(64 * 1024)  # reused for every read
+    # bufsize=0, so the pipes are raw FileIO objects whose readinto() returns whatever is available
+    streams: Dict[int, io.FileIO] = {s.fileno(): cast(io.FileIO, s) for s in (proc.stdout, proc.stderr) if s}
+    partial_lines: Dict[int, List[bytes]] = {fd: [] for fd in streams}  # output read since the last line ending
+    with selectors.DefaultSelector() as selector:
+        for fd in streams:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            for key, _ in selector.select():
+                pieces = partial_lines[key.fd]
+                n = streams[key.fd].readinto(buffer)
+                if n:
+                    chunk = bytes(memoryview(buffer)[:n])  # copied once, since buffer is reused
+                    pieces.append(chunk)
+                    if b"\n" not in chunk and b"\r" not in chunk:
+                        continue  # no complete line yet, so don't re-join what we have so far
+                    # Split on "\n", "\r" and "\r\n" like text mode's universal newlines, so "\r"-separated
+                    # progress output is logged line-by-line. The last line is kept for the next read if it has
+                    # no line ending yet, or if it ends in a "\r" that may be the first half of a split "\r\n".
+                    lines = b"".join(pieces).splitlines(keepends=True)
+                    pieces.clear()
+                    if not lines[-1].endswith(b"\n"):
+                        pieces.append(lines.pop())
+                else:
+                    # EOF, so flush any trailing output that didn't end in a newline
+                    selector.unregister(key.fd)
+                    remaining = b"".join(pieces)
+                    lines = [remaining] if remaining else []
+                _log_subprocess_lines(app_name, lines, from_stderr=streams[key.fd] is proc.stderr)
+
+
 @app.route("/", methods=["GET"])
 def index():
     return flask.Response("Python-Deployer v1.0.", status=200)
 
 
-for deploy_app in config.apps:
-
-    def make_route(_deploy_app: Config.App):
-        def handler():
-
-            _abort_if_payload_too_large()
-            _abort_if_invalid_signature()
+def _deploy_handler(_deploy_app: Config.App):
+    """
+    Deploy `_deploy_app` by running its `run_args` and logging their output. Bound to each app's
+    endpoint with `functools.partial`.
+    """
+    _abort_if_invalid_signature()
+
+    start = time.monotonic()
+    try:
+        logger.info(
+            "Starting deploy for '%s' using '%s' in '%s'...",
+            _deploy_app.name,
+            " ".join(_deploy_app.run_args),
+            _deploy_app.cwd,
+        )
 
-            start = now()
-            try:
-                logger.info(
-                    "Starting deploy for '%s' using '%s' in '%s'...",
-                    _deploy_app.name,
-                    " ".join(_deploy_app.run_args),
-                    _deploy_app.cwd,
+        os.chdir(_deploy_app.cwd)
+        working_dir = os.getcwd()
+        with subprocess.Popen(
+            _deploy_app.run_args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+            cwd=working_dir,
+        ) as proc:
+            _log_subprocess_output(proc, _deploy_app.name)
+            exit_code = proc.wait()
+            if exit_code == -15:
+                logger.warning(
+                    "Subprocess killed by SIGTERM — likely due to service restart. Did python-deployer just deploy itself?"
                 )
-
-                working_dir = os.chdir(_deploy_app.cwd) if os.chdir(_deploy_app.cwd) != "." else os.getcwd()
-                with subprocess.Popen(
-                    _deploy_app.run_args,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    cwd=working_dir,
-                ) as proc:
-                    if proc.stdout:
-                        for line in proc.stdout:
-                            logger.info(f"<{_deploy_app.name}> {line.strip()}")
-                    if proc.stderr:
-                        for line in proc.stderr:
-                            # some processes use stderr for normal logging. Try to interpret what
-                            # they are saying and also rely on exit_code for failure condition.
-                            if "error" in line.lower() or "failed" in line.lower():
-                                logger.error(f"<{_deploy_app.name}> {line.strip()}")
-                            else:
-                                logger.info(f"<{_deploy_app.name}> {line.strip()}")
-                    exit_code = proc.wait()
-                    if exit_code == -15:
-                        logger.warning(
-                            "Subprocess killed by SIGTERM — likely due to service restart. Did python-deployer just deploy itself?"
-                        )
-                    elif exit_code != 0:
-                        raise Exception(f"Subprocess exited with code: {exit_code}!")
-
-                elapsed = now().timestamp() - start.timestamp()
-                message = f"Deployment for {_deploy_app.name} succeeded in {elapsed:.2f} seconds."
-                return flask.jsonify({"success": True, "message": message}), 200
-
-            except Exception as e:
-                elapsed = now().timestamp() - start.timestamp()
-                logger.error(f"Failed to deploy app: {_deploy_app.name}.", exc_info=e)
-                message = f"Deployment failed after {elapsed:.2f} seconds."
-                return flask.jsonify({"success": False, "message": message}), 500
-
-        # give the function a unique name
-        handler.__name__ = f"handler_{uuid4().hex}"
-        app.route(_deploy_app.endpoint, methods=["POST"])(handler)
-
-    make_route(deploy_app)
+            elif exit_code != 0:
+                raise Exception(f"Subprocess exited with code: {exit_code}!")
+
+        elapsed = time.monotonic() - start
+        message = f"Deployment for {_deploy_app.name} succeeded in {elapsed:.2f} seconds."
+        return flask.jsonify({"success": True, "message": message}), 200
+
+    except Exception as e:
+        elapsed = time.monotonic() - start
+        logger.error(f"Failed to deploy app: {_deploy_app.name}.", exc_info=e)
+        message = f"Deployment failed after {elapsed:.2f} seconds."
+        return flask.jsonify({"success": False, "message": message}), 500
+
+
+for i, deploy_app in enumerate(config.apps):
+    view_func = functools.update_wrapper(functools.partial(_deploy_handler, deploy_app), _deploy_handler)
+    # give the view a unique (and readable) name, since Flask-Limiter uses it to identify the route. App names
+    # are only for logging and needn't be unique, so the app's index is what keeps it unique.
+    view_func.__name__ = f"handler_{i}_{re.sub(r'[^A-Za-z0-9_]', '_', deploy_app.name)}"  # type: ignore
+    app.add_url_rule(deploy_app.endpoint, endpoint=view_func.__name__, view_func=view_func, methods=["POST"])
     logger.debug(f"Created API route for '{deploy_app.name} @ {deploy_app.endpoint} --> {deploy_app.run_args}'")
 
 
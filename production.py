@@ -17,6 +17,25 @@ Entrypoint for running the app as a Gunicorn process that does three main things
     3. Normalizes Gunicorn logs and sends them to the Python logger.
 """
 
+# Matches, in a single pass, any of:
+#   - Gunicorn's timestamp like "[2025-09-03 17:17:55 -0400]";
+#   - Apache-style timestamp [03/Sep/2025:17:53:48 -0400], which come from gunicorn workers logging requests; or,
+#   - A PID like [82608], captured in group 1.
+_SCRUB_RE = re.compile(
+    r"\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} [+-]\d{4}\]"
+    r"|\[\d{2}/[A-Za-z]{3}/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4}\]"
+    r"|\[(\d+)\]"
+)
+
+# Gunicorn's log level text like "[INFO]", which follows the timestamp and PID.
+_LEVEL_RE = re.compile(r"\[(DEBUG|INFO|WARNING|ERROR)\]")
+_GUNICORN_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+}
+
 
 class StreamToLoggerFromGunicornProcess:
     """
@@ -31,39 +50,19 @@ class StreamToLoggerFromGunicornProcess:
         message = message.rstrip()
         if message:
 
-            # Remove Gunicorn's timestamp like "[2025-09-03 17:17:55 -0400]"
-            message = re.sub(r"\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} [+-]\d{4}\]", "", message)
-
-            # Remove Apache-style timestamp [03/Sep/2025:17:53:48 -0400], which come from gunicorn workers logging requests
-            message = re.sub(r"\[(\d{2}/[A-Za-z]{3}/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4})\]", "", message)
-
-            # Replace any PID like [82608] with (worker_pid: 82608)
-            message = re.sub(r"\[(\d+)\]", r"(worker_pid: \1)", message)
-
-            def _log(level: int, gunicorn_level_txt: str) -> None:
-                """
-                Inner log function that removes the gunicorn log level text and normalizes whitespace
-                by splitting on any whitespace and re-joining with a single space.
-                """
-                msg = " ".join(message.replace(gunicorn_level_txt, "").split())
-                logger.log(level=level, msg=msg)
-
-            # Simple heuristic to determine what level to log gunicorn messages at.
-            gunicorn_levels = {
-                logging.DEBUG: "[DEBUG]",
-                logging.INFO: "[INFO]",
-                logging.WARNING: "[WARNING]",
-                logging.ERROR: "[ERROR]",
-            }
-            logged = False
-            for level, gunicorn_level_txt in gunicorn_levels.items():
-                if gunicorn_level_txt in message:
-                    _log(level, gunicorn_level_txt)
-                    logged = True
-                    break
-            if logged == False:
-                # Default to INFO since gunicorn workers don't have any prefix when logging requests
-                _log(logging.INFO, "")
+            # Remove timestamps and replace any PID like [82608] with (worker_pid: 82608)
+            message = _SCRUB_RE.sub(lambda m: f"(worker_pid: {m.group(1)})" if m.group(1) else "", message)
+
+            # Simple heuristic to determine what level to log gunicorn messages at. Default to INFO
+            # since gunicorn workers don't have any prefix when logging requests.
+            level = logging.INFO
+            match = _LEVEL_RE.search(message)
+            if match:
+                level = _GUNICORN_LEVELS[match.group(1)]
+                message = message[: match.start()] + message[match.end() :]
+
+            # Normalize whitespace by splitting on any whitespace and re-joining with a single space.
+            logger.log(level=level, msg=" ".join(message.split()))
 
     def flush(self):
         pass  # needed for file-like interface
@@ -79,6 +78,11 @@ class GunicornApp(BaseApplication):
         super(GunicornApp, self).__init__()
 
     def load_config(self):
+        # Have the master call `load()` once before forking, rather than each worker calling it. The Flask app
+        # and config are already imported with this module, so workers share them either way; this just means a
+        # failure to load the app stops the master at startup. Can still be overridden by `preload_app` in config.yaml.
+        self.cfg.set("preload_app", True)  # type: ignore
+
         # Keep any configuration from the base class instance and add options from config.yaml.
         for key, value in config.gunicorn.options.items():
             self.cfg.set(key.lower(), value)  # type: ignore
@@ -88,12 +92,12 @@ class GunicornApp(BaseApplication):
 
 
 if __name__ == "__main__":
-    logger.debug(
-        "Starting gunicorn app '{}' for production environment with options: {}".format(
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Starting gunicorn app '%s' for production environment with options: %s",
             config.gunicorn.app_name,
-            json.dumps(config.to_dict(), indent=2),
+            json.dumps(config.to_dict()),
         )
-    )
     sys.stdout = StreamToLoggerFromGunicornProcess()
     sys.stderr = StreamToLoggerFromGunicornProcess()
     GunicornApp(flask_app).run()
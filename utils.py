@@ -1,25 +1,26 @@
 from flask import Request
 
 
-def request_to_sanitized_json(req: Request) -> dict:
+def request_to_sanitized_json(req: Request, parse_json: bool = False) -> dict:
     """
     Convert a Flask request into a safe JSON-serializable dict (should not contain any sensitive data).
+    The JSON body is only parsed when `parse_json` is set, since it may be large and usually isn't needed.
     """
     return {
         "method": req.method,
         "path": req.path,
         "query": req.args.to_dict(flat=True),  # type: ignore
         "form": req.form.to_dict(flat=True) if req.form else None,  # type: ignore
-        "json": req.get_json(silent=True) if req.is_json else None,
+        "json": req.get_json(silent=True) if parse_json and req.is_json else None,
         "ip": req.headers.get("X-Forwarded-For", req.remote_addr),
         "user_agent": req.user_agent.string,
     }
 
 
-def request_to_dirty_json(req: Request) -> dict:
+def request_to_dirty_json(req: Request, parse_json: bool = False) -> dict:
     """
     Convert a Flask request into a JSON-serializable dict that MAY CONTAIN SENSITIVE DATA like the X-Signature.
     """
-    return request_to_sanitized_json(req) | {
+    return request_to_sanitized_json(req, parse_json=parse_json) | {
         "headers": {key: value for key, value in req.headers.items()},
     }